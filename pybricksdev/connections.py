@@ -4,6 +4,10 @@ import asyncssh
 import os
 
 
+# Nordic UART Service UUID advertised by Pybricks hubs
+NUS_SERVICE_UUID = '6e400001-b5a3-f393-e0a9-e50e24dcca9e'
+
+
 async def find_ble_device(name, timeout=5):
     """Quickly find BLE device address by friendly device name.
 
@@ -25,46 +29,35 @@ async def find_ble_device(name, timeout=5):
             Device was not found within the timeout.
     """
 
-    # Flag raised by detection of a device
-    device_discovered = False
-
-    def set_device_discovered(*args):
-        nonlocal device_discovered
-        device_discovered = True
-
-    # Create scanner object and register callback to raise discovery flag
-    scanner = BleakScanner()
-    scanner.register_detection_callback(set_device_discovered)
+    # Future that the detection callback completes with the device address
+    found = asyncio.get_event_loop().create_future()
+
+    def set_device_discovered(device, advertisement_data):
+        # If the name matches, complete the future with the address. The
+        # callback may fire again before we stop the scanner, hence the
+        # done() guard.
+        if device.name and name in device.name and not found.done():
+            found.set_result(device.address)
+
+    # Create scanner object with the callback to complete the future. The
+    # service filter lets the host BLE stack drop advertisements from
+    # unrelated devices before they ever reach us.
+    scanner = BleakScanner(
+        detection_callback=set_device_discovered,
+        service_uuids=[NUS_SERVICE_UUID],
+    )
 
-    # Start the scanner
+    # Start the scanner and wait for the matching advertisement, instead of
+    # re-checking the full list of discovered devices on a timer.
     await scanner.start()
-
-    INTERVAL = 0.1
-
-    # Sleep until a device of interest is discovered. We cheat by using the
-    # cross-platform get_discovered_devices() ahead of time, instead of waiting
-    # for the whole discover() process to complete. We call it every time
-    # a new device is detected by the register_detection_callback.
-    for i in range(round(timeout/INTERVAL)):
-        # If device_discovered flag is raised, check if it's the right one.
-        if device_discovered:
-            # Unset the flag so we only check if raised again.
-            device_discovered = False
-            # Check if any of the devices found so far has the expected name.
-            devices = await scanner.get_discovered_devices()
-            for dev in devices:
-                # If the name matches, stop scanning and return address.
-                if name == dev.name:
-                    await scanner.stop()
-                    return dev.address
-        # Await until we check again.
-        await asyncio.sleep(INTERVAL)
-
-    # If we are here, scanning has timed out.
-    await scanner.stop()
-    raise TimeoutError(
-        "Could not find {0} in {1} seconds".format(name, timeout)
-    )
+    try:
+        return await asyncio.wait_for(found, timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(
+            "Could not find {0} in {1} seconds".format(name, timeout)
+        )
+    finally:
+        await scanner.stop()
 
 
 class EV3Connection():
@@ -3,7 +3,9 @@
 
 import asyncio
 from bleak import BleakClient
+from functools import reduce
 import logging
+from operator import xor
 
 from pybricksdev.compile import (
     compile_argparser,
@@ -16,18 +18,51 @@ bleNusCharRXUUID = '6e400002-b5a3-f393-e0a9-e50e24dcca9e'
 bleNusCharTXUUID = '6e400003-b5a3-f393-e0a9-e50e24dcca9e'
 
 
+def xor_checksum(data):
+    """Computes the XOR of all bytes, eight bytes at a time."""
+    mv = memoryview(data)
+    pad = -len(mv) % 8
+    if pad:
+        # Zero padding does not change the XOR
+        padded = bytearray(mv)
+        padded.extend(bytes(pad))
+        mv = memoryview(padded)
+    word = reduce(xor, mv.cast('Q'), 0)
+    # Fold the 64-bit result down to one byte
+    word ^= word >> 32
+    word ^= word >> 16
+    word ^= word >> 8
+    return word & 0xFF
+
+
 class HubDataReceiver():
 
+    # Fixed attribute slots: no per-instance dict, and cheaper attribute
+    # access in the per-notify hot path
+    __slots__ = ('buf', 'state', 'reply', '_reply_event', '_not_running',
+                 'logger', '_debug', 'log_file')
+
     UNKNOWN = 0
     IDLE = 1
     RUNNING = 2
     ERROR = 3
     CHECKING = 4
 
+    # Maps state strings to states with a single hash lookup per line
+    _STATE_MAP = {
+        b'>>>> IDLE': IDLE,
+        b'>>>> RUNNING': RUNNING,
+        b'>>>> ERROR': ERROR,
+    }
+
     def __init__(self, debug=False):
-        self.buf = b''
+        self.buf = bytearray()
         self.state = self.UNKNOWN
         self.reply = None
+        self._reply_event = asyncio.Event()
+        # Set whenever the state is anything but RUNNING
+        self._not_running = asyncio.Event()
+        self._not_running.set()
 
         # Get a logger
         self.logger = logging.getLogger('Hub Data')
@@ -38,6 +73,8 @@ class HubDataReceiver():
         handler.setFormatter(formatter)
         self.logger.addHandler(handler)
         self.logger.setLevel(logging.DEBUG if debug else logging.INFO)
+        # Cached so hot paths can skip building debug log arguments
+        self._debug = self.logger.isEnabledFor(logging.DEBUG)
 
         # Data log state
         self.log_file = None
@@ -52,7 +89,9 @@ class HubDataReceiver():
                 raise OSError("Log file is already open!")
             name = text[6:]
             self.logger.info("Saving log to {0}.".format(name))
-            self.log_file = open(name, 'w')
+            # Use a large write buffer so fast datalog streams do not pay
+            # one syscall per line; everything is flushed on close
+            self.log_file = open(name, 'w', buffering=1 << 20)
             return
 
         # Enf of data log file, so close it
@@ -74,82 +113,97 @@ class HubDataReceiver():
         print(text)
 
     def update_data_buffer(self, sender, data):
-        # If we are transmitting, the replies are checksums
-        if self.state == self.CHECKING:
+        # If we are transmitting, the replies are checksums. Once a reply
+        # has been latched, anything further is regular output again, even
+        # if the waiter has not consumed the reply yet.
+        if self.state == self.CHECKING and not self._reply_event.is_set():
             self.reply = data[-1]
-            self.logger.debug("\t\t\t\tCS: {0}".format(self.reply))
+            self.logger.debug("\t\t\t\tCS: %s", self.reply)
+            self._reply_event.set()
+            return
+
+        # Otherwise, append incoming data to buffer. Extending a bytearray
+        # grows it in place instead of copying the whole buffer each time.
+        self.buf.extend(data)
+
+        # Break out all complete lines in one C-level scan. The last part
+        # is the trailing partial line, which stays in the buffer.
+        parts = self.buf.split(b'\r\n')
+        if len(parts) == 1:
             return
 
-        # Otherwise, append incoming data to buffer
-        self.buf += data
-
-        # Break up data into lines as soon as a line is complete
-        while True:
-            try:
-                # Try to find line break and split there
-                index = self.buf.index(b'\r\n')
-                line = self.buf[0:index]
-                self.buf = self.buf[index+2:]
-
-                # Check line contents to see if state needs updating
-                self.logger.debug("\t\t\t\tRX: {0}".format(line))
-
-                # If the retrieved line is a state, update it
-                if self.map_state(line) is not None:
-                    self.update_state(self.map_state(line))
-
-                # Process special lines else print as human readable
-                self.process_line(line)
-            # Exit the loop once no more line breaks are found
-            except ValueError:
-                break
-
-    def map_state(self, line):
-        """"Maps state strings to states."""
-        if line == b'>>>> IDLE':
-            return self.IDLE
-        if line == b'>>>> RUNNING':
-            return self.RUNNING
-        if line == b'>>>> ERROR':
-            return self.ERROR
-        return None
+        # Drop the consumed data before processing; the parts hold their
+        # own copies. An error raised while processing a line then cannot
+        # replay already-handled lines on the next notify.
+        remainder = parts.pop()
+        del self.buf[:len(self.buf) - len(remainder)]
+
+        for part in parts:
+            line = bytes(part)
+
+            # Check line contents to see if state needs updating
+            self.logger.debug("\t\t\t\tRX: %s", line)
+
+            # If the retrieved line is a state, update it
+            new_state = self._STATE_MAP.get(line)
+            if new_state is not None:
+                self.update_state(new_state)
+
+            # Process special lines else print as human readable
+            self.process_line(line)
 
     def update_state(self, new_state):
         """Updates state if data contains state information."""
         if new_state != self.state:
-            self.logger.debug("New State: {0}".format(new_state))
+            self.logger.debug("New State: %s", new_state)
             self.state = new_state
+            if new_state == self.RUNNING:
+                self._not_running.clear()
+            else:
+                self._not_running.set()
 
     def update_state_disconnected(self, client, *args):
         self.update_state(self.UNKNOWN)
         self.logger.info("Disconnected!")
 
     async def wait_for_checksum(self):
-        self.update_state(self.CHECKING)
-        for i in range(50):
-            await asyncio.sleep(0.01)
-            if self.reply is not None:
-                reply = self.reply
-                self.reply = None
-                self.update_state(self.IDLE)
-                return reply
-        raise TimeoutError("Hub did not return checksum")
+        # The event is set by update_data_buffer as soon as the reply
+        # notification comes in, so there is no need to poll for it. The
+        # caller clears the event and enters the checking state before
+        # sending, so a reply that arrives early is not lost.
+        try:
+            await asyncio.wait_for(self._reply_event.wait(), timeout=0.5)
+        except asyncio.TimeoutError:
+            raise TimeoutError("Hub did not return checksum")
+        reply = self.reply
+        self.reply = None
+        self.update_state(self.IDLE)
+        return reply
 
     async def wait_until_not_running(self):
-        await asyncio.sleep(0.5)
-        while True:
-            await asyncio.sleep(0.1)
-            if self.state != self.RUNNING:
-                break
+        # Give the hub a moment to report that the program has started,
+        # then wait for update_state to signal that it is done
+        await asyncio.sleep(0.1)
+        await self._not_running.wait()
 
 
 class PybricksHubConnection(HubDataReceiver):
 
+    __slots__ = ('client', '_chunk')
+
+    def __init__(self, debug=False):
+        super().__init__(debug)
+        # Safe pre-connect default: the BLE 4.0 minimum ATT payload
+        self._chunk = 20
+
     async def connect(self, address):
         self.logger.info("Connecting to {0}".format(address))
         self.client = BleakClient(address)
         await self.client.connect()
         self.client.set_disconnected_callback(self.update_state_disconnected)
+        # Use the negotiated ATT MTU minus the 3-byte header for each write,
+        # so fewer GATT round trips are needed per message
+        self._chunk = max(20, getattr(self.client, 'mtu_size', 23) - 3)
         self.logger.info("Connected successfully!")
         await self.client.start_notify(
             bleNusCharTXUUID, self.update_data_buffer
@@ -160,12 +214,21 @@ class PybricksHubConnection(HubDataReceiver):
         await self.client.disconnect()
 
     async def write(self, data):
-        n = 20
-        chunks = [data[i: i + n] for i in range(0, len(data), n)]
-        for i, chunk in enumerate(chunks):
-            self.logger.debug("\t\t\t\tTX: {0}".format(chunk))
-            await asyncio.sleep(0.05)
-            await self.client.write_gatt_char(bleNusCharRXUUID, bytearray(chunk))
+        # Slice chunks off a memoryview so nothing is copied; bleak accepts
+        # any buffer-protocol object directly
+        mv = memoryview(data)
+        n = self._chunk
+        for i in range(0, len(mv), n):
+            chunk = mv[i:i + n]
+            if self._debug:
+                self.logger.debug("\t\t\t\tTX: %s", bytes(chunk))
+            # Write without response for all but the last chunk, so the
+            # stack can pack them into the same connection interval. The
+            # response on the final chunk paces us to the peripheral.
+            await self.client.write_gatt_char(
+                bleNusCharRXUUID, chunk,
+                response=(i + n >= len(mv))
+            )
 
     async def send_message(self, data):
         """Send bytes to the hub, and check if reply matches checksum."""
@@ -174,16 +237,27 @@ class PybricksHubConnection(HubDataReceiver):
             raise ValueError("Cannot send this much data at once")
 
         # Compute expected reply
-        checksum = 0
-        for b in data:
-            checksum ^= b
+        checksum = xor_checksum(data)
+
+        # Begin waiting for the reply before sending, so that notification
+        # reception overlaps with the remaining GATT writes. Clear the event
+        # and enter the checking state up front in case the reply beats the
+        # task.
+        self._reply_event.clear()
+        self.update_state(self.CHECKING)
+        reply_task = asyncio.create_task(self.wait_for_checksum())
 
-        # Send the data
-        await self.write(data)
+        # Send the data, making sure the wait task does not linger and
+        # time out unobserved if a write fails
+        try:
+            await self.write(data)
+        except BaseException:
+            reply_task.cancel()
+            raise
 
         # Await the reply
-        reply = await self.wait_for_checksum()
-        self.logger.debug("expected: {0}, reply: {1}".format(checksum, reply))
+        reply = await reply_task
+        self.logger.debug("expected: %s, reply: %s", checksum, reply)
 
         # Raise errors if we did not get the checksum we wanted
         if reply is None:
@@ -197,16 +271,18 @@ class PybricksHubConnection(HubDataReceiver):
         length = len(mpy).to_bytes(4, byteorder='little')
         await self.send_message(length)
 
-        # Divide script in chunks of bytes
+        # Send the data in chunks of bytes, sliced off a memoryview as we
+        # go rather than materialized as a list of copies up front
+        mv = memoryview(mpy)
         n = 100
-        chunks = [mpy[i: i + n] for i in range(0, len(mpy), n)]
-
-        # Send the data chunk by chunk
-        for i, chunk in enumerate(chunks):
-            self.logger.info("Sending: {0}%".format(
-                round((i+1)/len(chunks)*100))
-            )
-            await self.send_message(chunk)
+        last_pct = -1
+        for i in range(0, len(mv), n):
+            # Only log when the integer percentage actually changes
+            pct = min(i + n, len(mv)) * 100 // len(mv)
+            if pct != last_pct:
+                self.logger.info("Sending: {0}%".format(pct))
+                last_pct = pct
+            await self.send_message(mv[i:i + n])
 
         # Wait for the program to finish
         await self.wait_until_not_running()
@@ -220,16 +296,24 @@ if __name__ == "__main__":
     )
     args = parser.parse_args()
 
-    # Convert either the file or the string to mpy format
-    if args.file is not None:
-        data = compile_file(args.file, args.mpy_cross)
-    else:
-        data = compile_str(args.string, args.mpy_cross)
-
-    async def main(mpy):
+    async def main(args):
+        # Convert either the file or the string to mpy format. Run the
+        # compiler in a thread so it overlaps with the BLE scan, which is
+        # I/O bound and releases the GIL.
+        loop = asyncio.get_event_loop()
+        if args.file is not None:
+            compile_task = loop.run_in_executor(
+                None, compile_file, args.file, args.mpy_cross
+            )
+        else:
+            compile_task = loop.run_in_executor(
+                None, compile_str, args.string, args.mpy_cross
+            )
 
         print("Scanning for Pybricks Hub")
-        address = await find_ble_device('Pybricks Hub', timeout=5)
+        mpy, address = await asyncio.gather(
+            compile_task, find_ble_device('Pybricks Hub', timeout=5)
+        )
         print("Found {0}!".format(address))
 
         hub = PybricksHubConnection(debug=False)
@@ -237,4 +321,4 @@ if __name__ == "__main__":
         await hub.download_and_run(mpy)
 
     # Asynchronously send and run the script
-    asyncio.run(main(data))
+    asyncio.run(main(args))